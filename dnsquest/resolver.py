@@ -1,13 +1,34 @@
 #!/usr/bin/env python3
 
+import asyncio
+import functools
+import itertools
+import random
+import select
+import socket
+import struct
+import threading
 import time
 import datetime
-import dns.query
+import dns.asyncquery
+import dns.entropy
+import dns.exception
+import dns.flags
 import dns.message
 import dns.rdatatype
 import dns.rdataclass
 import dns.name
-import dns.exception
+import dns.rcode
+
+# Constants compared on every rrset and response, bound once at module level
+_A = dns.rdatatype.A
+_CNAME = dns.rdatatype.CNAME
+_NS = dns.rdatatype.NS
+_SOA = dns.rdatatype.SOA
+_IN = dns.rdataclass.IN
+_NOERROR = dns.rcode.NOERROR
+_NXDOMAIN = dns.rcode.NXDOMAIN
+_QR = dns.flags.QR
 
 
 class DNSResolutionError(Exception):
@@ -34,8 +55,90 @@ class NoRecordError(DNSResolutionError):
     pass
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_name(text):
+    """Parse a domain name, reusing the result for names seen before"""
+    return dns.name.from_text(text)
+
+
+@functools.lru_cache(maxsize=4096)
+def _name_wire(name):
+    """Return the uncompressed wire form of an absolute name"""
+    return name.to_wire()
+
+
+def _answer_chain(response, name, rdtype):
+    """Follow the CNAME chain for name through a response's answer section
+
+    Returns the (alias, TTL) pairs along the chain, the name it ends at, and
+    the rdtype rrset owned by that name, or None if the answer has none.
+    Records owned by names off the chain are never looked at.
+    """
+    rrsets = {(rrset.name, rrset.rdtype): rrset for rrset in response.answer}
+    aliases = []
+    while True:
+        rrset = rrsets.get((name, rdtype))
+        if rrset is not None:
+            return aliases, name, rrset
+        cname = rrsets.get((name, _CNAME))
+        if cname is None or any(alias == name for alias, _ in aliases):
+            return aliases, name, None
+        aliases.append((name, cname.ttl))
+        name = cname[0].target
+
+
+class _Lookup:
+    """Progress of one name being walked down the DNS hierarchy"""
+
+    __slots__ = (
+        "qname",
+        "qtype",
+        "depth",
+        "nameservers",
+        "bailiwick",
+        "aliases",
+        "referrals",
+        "zone",
+        "zone_ttl",
+        "next_servers",
+        "ns_names",
+        "ns_name",
+    )
+
+    def __init__(self, qname, qtype, depth):
+        self.qname = qname
+        self.qtype = qtype
+        # How many glue-less nameserver lookups this one is nested inside
+        self.depth = depth
+        self.nameservers = None
+        # Zone the current nameservers serve; referrals must lead below it
+        self.bailiwick = None
+        # CNAME aliases followed so far, as (alias, TTL)
+        self.aliases = []
+        self.referrals = 0
+        # Zone and nameservers from the referral currently being followed
+        self.zone = None
+        self.zone_ttl = 0
+        # Nameserver sockaddrs gathered so far, as an insertion-ordered set
+        self.next_servers = {}
+        # Glue-less NS names not yet looked up, kept as a fallback until the
+        # referral's nameservers answer, and the one being looked up now
+        self.ns_names = None
+        self.ns_name = None
+
+
 class DNSQuestResolver:
-    ROOT_SERVERS = [
+    __slots__ = (
+        "query_start_time",
+        "_cache",
+        "_nx_cache",
+        "_ns_cache",
+        "_zone_cache",
+        "_local",
+        "_root_rr_idx",
+    )
+
+    ROOT_SERVERS = (
         "198.41.0.4",  # a.root-servers.net
         "170.247.170.2",  # b.root-servers.net
         "192.33.4.12",  # c.root-servers.net
@@ -49,130 +152,281 @@ class DNSQuestResolver:
         "193.0.14.129",  # k.root-servers.net
         "199.7.83.42",  # l.root-servers.net
         "202.12.27.33",  # m.root-servers.net
-    ]
+    )
+
+    # Root servers as ready-made (address, port) pairs for sendto(); nameservers
+    # are passed around in this form so nothing rebuilds them per query
+    _ROOT_SOCKADDRS = tuple((ip, 53) for ip in ROOT_SERVERS)
+
+    # Special-use TLDs that are never delegated from the root (RFC 2606, 6761, 6762, 7686)
+    RESERVED_TLDS = frozenset(
+        {"example", "invalid", "local", "localhost", "onion", "test"}
+    )
+
+    # Wire header of a one-question query with the same flags as make_query();
+    # only the transaction ID in bytes 0-1 changes between queries
+    _QUERY_HEADER = bytes(dns.message.make_query(dns.name.root, _A).to_wire()[:12])
+
+    # Nameservers probed concurrently, and per-probe timeout in seconds
+    PARALLEL_QUERIES = 3
+    QUERY_TIMEOUT = 2
+
+    # Limits that stop misconfigured zones from looping forever
+    MAX_CNAME_HOPS = 16
+    MAX_REFERRALS = 16
+    MAX_NS_DEPTH = 4
 
     def __init__(self):
         self.query_start_time = None
+        # (qname, qtype) -> (expiry, response) for answers we have already walked
+        self._cache = {}
+        # name -> (expiry, True) for names a server answered NXDOMAIN for
+        self._nx_cache = {}
+        # nameserver name -> (expiry, sockaddrs) from glue and NS lookups
+        self._ns_cache = {}
+        # zone name -> (expiry, nameserver sockaddrs) learned from referrals
+        self._zone_cache = {}
+        # Per-thread state: the UDP socket reused for the queries of that
+        # thread's current resolve(), created on first use, so concurrent
+        # threads never read each other's replies
+        self._local = threading.local()
+        # Root server each walk from the roots starts at, rotated per walk
+        self._root_rr_idx = random.randrange(len(self.ROOT_SERVERS))
 
     def resolve(self, domain):
-        self.query_start_time = time.time()
-
-        if not domain.endswith("."):
-            domain += "."
+        self.query_start_time = time.monotonic_ns()
 
-        domain_name = dns.name.from_text(domain)
+        domain_name = self._validate_syntax(domain)
 
         try:
-            final_answer = self._iterative_resolve(
-                domain_name, dns.rdatatype.A, self.ROOT_SERVERS
-            )
+            final_answer = self._iterative_resolve(domain_name, _A)
             return final_answer
         except (NXDomainError, TimeoutError, NoRecordError) as e:
             # Re-raise specific DNS errors
             raise
         except Exception as e:
-            raise DNSResolutionError(f"Failed to resolve {domain}: {str(e)}")
+            raise DNSResolutionError(f"Failed to resolve {domain_name}: {str(e)}")
+        finally:
+            # The next resolve() opens a new socket, so each resolution's
+            # queries leave from a fresh random source port
+            self.close()
+
+    async def aresolve(self, domain):
+        """Resolve domain like resolve(), but on the running asyncio event loop
+
+        Lets many resolutions run concurrently on one thread, e.g. with
+        asyncio.gather(). They share this resolver's caches; query_start_time
+        records the most recent call.
+        """
+        self.query_start_time = time.monotonic_ns()
+
+        domain_name = self._validate_syntax(domain)
 
-    def _iterative_resolve(self, qname, qtype, nameservers):
+        try:
+            return await self._aiterative_resolve(domain_name, _A)
+        except (NXDomainError, TimeoutError, NoRecordError):
+            # Re-raise specific DNS errors
+            raise
+        except Exception as e:
+            raise DNSResolutionError(f"Failed to resolve {domain_name}: {str(e)}")
+
+    def _validate_syntax(self, domain):
+        """Reject names that cannot exist before sending any queries
+
+        Returns the domain parsed into an absolute dns.name.Name.
+        """
+        name = domain[:-1] if domain.endswith(".") else domain
+        if not name or len(name) > 253:
+            raise NXDomainError(f"Domain {domain} is not a valid domain name")
+
+        labels = name.split(".")
+        for label in labels:
+            if not 1 <= len(label) <= 63 or not all(
+                c.isalnum() or c in "-_" for c in label
+            ):
+                raise NXDomainError(f"Domain {domain} is not a valid domain name")
+
+        if labels[-1].lower() in self.RESERVED_TLDS:
+            raise NXDomainError(
+                f"Domain {domain} does not exist (reserved TLD .{labels[-1]})"
+            )
+
+        # from_text() makes relative names absolute, so no trailing dot is needed
+        try:
+            return _parse_name(domain)
+        except dns.exception.DNSException:
+            # Non-ASCII labels can still be too long once IDNA-encoded
+            raise NXDomainError(f"Domain {domain} is not a valid domain name")
+
+    def close(self):
+        """Close the calling thread's UDP socket
+
+        resolve() already closes its socket when it returns, so this is only
+        needed after calling _probe() directly.
+        """
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _socket(self):
+        """Return the calling thread's UDP socket, opening one if needed
+
+        The socket is reused for every query of one resolve() and closed when
+        it returns.
+        """
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("", 0))
+            # Reads are driven by select() in _probe and must never block
+            sock.setblocking(False)
+            self._local.sock = sock
+        return sock
+
+    def _probe(self, qname, qtype, nameservers):
+        """Query several nameservers concurrently and return the first usable response
+
+        Returns the response together with the sockaddr of the nameserver that
+        sent it.
+        """
+        wire = bytearray(self._QUERY_HEADER)
+        struct.pack_into(">H", wire, 0, dns.entropy.random_16())
+        wire += _name_wire(qname)
+        wire += struct.pack(">HH", qtype, _IN)
+        txid = bytes(wire[:2])
+        sock = self._socket()
+        remaining = iter(nameservers)
+        # nameserver sockaddr -> deadline for every probe still waiting on a reply
+        outstanding = {}
         last_timeout_error = None
         successful_responses = 0
 
-        for ns in nameservers:
-            try:
-                query = dns.message.make_query(qname, qtype, dns.rdataclass.IN)
-                response = dns.query.udp(query, ns, timeout=5)
-                successful_responses += 1
+        while True:
+            # Keep up to PARALLEL_QUERIES probes in flight
+            for sockaddr in itertools.islice(
+                remaining, self.PARALLEL_QUERIES - len(outstanding)
+            ):
+                try:
+                    sock.sendto(wire, sockaddr)
+                except OSError:
+                    continue
+                outstanding[sockaddr] = time.monotonic() + self.QUERY_TIMEOUT
+
+            if not outstanding:
+                break
 
-                # Check for NXDOMAIN (domain does not exist)
-                if response.rcode() == dns.rcode.NXDOMAIN:
-                    raise NXDomainError(f"Domain {qname} does not exist (NXDOMAIN)")
-
-                # Check if we got an answer
-                if response.answer:
-                    for rrset in response.answer:
-                        if rrset.rdtype == dns.rdatatype.CNAME:
-                            cname_target = rrset[0].target
-                            return self._iterative_resolve(
-                                cname_target, qtype, self.ROOT_SERVERS
-                            )
-                        elif rrset.rdtype == qtype:
-                            return response
-
-                # Try to follow additional records (glue records)
-                if response.additional:
-                    next_servers = []
-                    for rrset in response.additional:
-                        if rrset.rdtype == dns.rdatatype.A:
-                            next_servers.extend([rr.address for rr in rrset])
-
-                    if next_servers:
-                        return self._iterative_resolve(qname, qtype, next_servers)
-
-                # Try to follow authority records (NS records)
-                if response.authority:
-                    ns_names = []
-                    ns_records_found = False
-
-                    for rrset in response.authority:
-                        if rrset.rdtype == dns.rdatatype.NS:
-                            ns_records_found = True
-                            ns_names.extend([str(rr.target) for rr in rrset])
-                        # Check for SOA record which might indicate NXDOMAIN or no such record
-                        elif rrset.rdtype == dns.rdatatype.SOA:
-                            # SOA without NS could mean the name exists but no A record
-                            if not ns_records_found and qtype == dns.rdatatype.A:
-                                raise NoRecordError(f"No A record found for {qname}")
-
-                    if ns_names:
-                        next_servers = []
-                        for ns_name in ns_names:
-                            try:
-                                ns_response = self._iterative_resolve(
-                                    dns.name.from_text(ns_name),
-                                    dns.rdatatype.A,
-                                    self.ROOT_SERVERS,
-                                )
-                                if ns_response and ns_response.answer:
-                                    for rrset in ns_response.answer:
-                                        if rrset.rdtype == dns.rdatatype.A:
-                                            next_servers.extend(
-                                                [rr.address for rr in rrset]
-                                            )
-                            except (NXDomainError, TimeoutError, NoRecordError):
-                                # If NS resolution fails, try next NS
-                                continue
-                            except Exception:
-                                continue
-
-                        if next_servers:
-                            return self._iterative_resolve(qname, qtype, next_servers)
-                        else:
-                            # We found NS records but couldn't resolve any of them
-                            raise NoRecordError(
-                                f"Found NS records but could not resolve any nameserver IPs for {qname}"
-                            )
-
-                # If we got a response but no answer, additional, or authority with useful info
-                # This shouldn't normally happen, try next server
-
-            except dns.exception.Timeout:
-                # Save timeout error but try other servers first
-                last_timeout_error = TimeoutError(
-                    f"DNS query timed out for {qname} at server {ns}"
-                )
+            now = time.monotonic()
+            for sockaddr, deadline in list(outstanding.items()):
+                if deadline <= now:
+                    # Save timeout error but try other servers first
+                    del outstanding[sockaddr]
+                    last_timeout_error = TimeoutError(
+                        f"DNS query timed out for {qname} at server {sockaddr[0]}"
+                    )
+            if not outstanding:
                 continue
-            except (NXDomainError, NoRecordError):
-                # Re-raise specific DNS errors immediately
-                raise
-            except Exception as e:
-                # Log but continue to next server for other errors
+
+            # One wait covers every outstanding probe, until the earliest deadline
+            ready, _, _ = select.select([sock], [], [], min(outstanding.values()) - now)
+            if not ready:
                 continue
 
+            # Drain every reply that has arrived before waiting again
+            while True:
+                try:
+                    data, sockaddr = sock.recvfrom(4096)
+                except OSError:
+                    break
+
+                # Replies to other queries or from servers we did not ask are stale
+                if data[:2] != txid or sockaddr not in outstanding:
+                    continue
+                try:
+                    response = dns.message.from_wire(data)
+                except Exception:
+                    continue
+                question = response.question
+                if (
+                    not response.flags & _QR
+                    or len(question) != 1
+                    or question[0].name != qname
+                    or question[0].rdtype != qtype
+                ):
+                    continue
+
+                del outstanding[sockaddr]
+                successful_responses += 1
+                if response.rcode() in (_NOERROR, _NXDOMAIN):
+                    return response, sockaddr
+
+        self._probe_failed(qname, last_timeout_error, successful_responses)
+
+    async def _aprobe(self, qname, qtype, nameservers):
+        """Asynchronous _probe using dns.asyncquery"""
+        query = dns.message.make_query(qname, qtype, _IN)
+        remaining = iter(nameservers)
+        pending = {}
+        last_timeout_error = None
+        successful_responses = 0
+
+        try:
+            while True:
+                # Keep up to PARALLEL_QUERIES probes in flight
+                for sockaddr in itertools.islice(
+                    remaining, self.PARALLEL_QUERIES - len(pending)
+                ):
+                    ip, port = sockaddr
+                    task = asyncio.ensure_future(
+                        dns.asyncquery.udp(
+                            query, ip, timeout=self.QUERY_TIMEOUT, port=port
+                        )
+                    )
+                    pending[task] = sockaddr
+
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    sockaddr = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except dns.exception.Timeout:
+                        # Save timeout error but try other servers first
+                        last_timeout_error = TimeoutError(
+                            f"DNS query timed out for {qname} at server {sockaddr[0]}"
+                        )
+                        continue
+                    except Exception:
+                        continue
+
+                    successful_responses += 1
+                    if response.rcode() in (_NOERROR, _NXDOMAIN):
+                        return response, sockaddr
+        finally:
+            # Cancel the slower probes once a useful response arrives
+            for task in pending:
+                task.cancel()
+
+        self._probe_failed(qname, last_timeout_error, successful_responses)
+
+    @staticmethod
+    def _probe_failed(qname, last_timeout_error, successful_responses):
+        """Raise the error for a probe that got no usable response"""
         # If we tried all servers and got timeouts
         if last_timeout_error and successful_responses == 0:
             raise last_timeout_error
 
-        # If we got responses but no useful records
+        # If we got responses but none of them were usable
         if successful_responses > 0:
             raise NoRecordError(f"No A or NS records found for {qname}")
 
@@ -181,6 +435,288 @@ class DNSQuestResolver:
             f"Unable to resolve domain {qname}: all nameservers failed"
         )
 
+    @staticmethod
+    def _cache_get(cache, key):
+        """Return the cached value for key, dropping it if its TTL has expired"""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        expiry, value = entry
+        if expiry <= time.monotonic():
+            cache.pop(key, None)
+            return None
+        return value
+
+    @staticmethod
+    def _cache_put(cache, key, value, ttl):
+        cache[key] = (time.monotonic() + ttl, value)
+
+    def _cache_aliases(self, aliases, qtype, response):
+        """Cache the final answer under each CNAME alias that led to it"""
+        ttl = min(rrset.ttl for rrset in response.answer)
+        for alias, alias_ttl in reversed(aliases):
+            ttl = min(ttl, alias_ttl)
+            self._cache_put(self._cache, (alias, qtype), response, ttl)
+        return response
+
+    @staticmethod
+    def _negative_ttl(response):
+        """Return how long an NXDOMAIN may be cached, per its SOA (RFC 2308)"""
+        for rrset in response.authority:
+            if rrset.rdtype == _SOA:
+                return min(rrset.ttl, rrset[0].minimum, 300)
+        return 60
+
+    def _root_servers(self):
+        """Return the root servers starting at a rotating offset"""
+        i = self._root_rr_idx
+        self._root_rr_idx = (i + 1) % len(self.ROOT_SERVERS)
+        return self._ROOT_SOCKADDRS[i:] + self._ROOT_SOCKADDRS[:i]
+
+    def _closest_nameservers(self, qname):
+        """Return the closest cached zone enclosing qname and its nameservers"""
+        zone = qname
+        while True:
+            nameservers = self._cache_get(self._zone_cache, zone)
+            if nameservers is not None:
+                return zone, nameservers
+            if zone == dns.name.root:
+                return zone, self._root_servers()
+            zone = zone.parent()
+
+    def _iterative_resolve(self, qname, qtype):
+        steps = self._resolution(qname, qtype)
+        send, value = steps.send, None
+        while True:
+            try:
+                lookup = send(value)
+            except StopIteration as done:
+                return done.value
+
+            try:
+                value = self._probe(lookup.qname, lookup.qtype, lookup.nameservers)
+                send = steps.send
+            except Exception as e:
+                value = e
+                send = steps.throw
+
+    async def _aiterative_resolve(self, qname, qtype):
+        steps = self._resolution(qname, qtype)
+        send, value = steps.send, None
+        while True:
+            try:
+                lookup = send(value)
+            except StopIteration as done:
+                return done.value
+
+            try:
+                value = await self._aprobe(
+                    lookup.qname, lookup.qtype, lookup.nameservers
+                )
+                send = steps.send
+            except Exception as e:
+                value = e
+                send = steps.throw
+
+    def _resolution(self, qname, qtype):
+        """Walk qname down the hierarchy without doing any I/O itself
+
+        A generator shared by the sync and async resolvers: it yields each
+        _Lookup whose nameservers must be queried, expects the response and the
+        sockaddr that sent it (or the probe's exception) to be sent back, and
+        returns the final response.
+        """
+        # Lookups in progress, used as a stack: the last one is running and each
+        # one below it is waiting on a nameserver address from the one above
+        work = [_Lookup(qname, qtype, 0)]
+
+        while True:
+            lookup = work[-1]
+            try:
+                result = yield from self._advance(lookup)
+            except Exception:
+                if len(work) == 1:
+                    raise
+                # If NS resolution fails, the waiting lookup tries its next NS
+                work.pop()
+                continue
+
+            if isinstance(result, _Lookup):
+                work.append(result)
+            elif result is not None:
+                work.pop()
+                if not work:
+                    return result
+
+                # Only the addresses owned by the nameserver's name, or the
+                # end of its CNAME chain, belong to it
+                waiting = work[-1]
+                _, _, rrset = _answer_chain(result, result.question[0].name, _A)
+                if rrset is not None:
+                    sockaddrs = [(rr.address, 53) for rr in rrset]
+                    self._cache_put(
+                        self._ns_cache, waiting.ns_name, sockaddrs, rrset.ttl
+                    )
+                    waiting.next_servers.update(dict.fromkeys(sockaddrs))
+
+    def _advance(self, lookup):
+        """Run one step of a lookup, yielding it when its nameservers must be queried
+
+        Returns the final response once the lookup is answered, a new _Lookup
+        for a nameserver address that must be found first, or None when the
+        lookup moved on to other nameservers and should simply be advanced again.
+        """
+        if lookup.nameservers is None and lookup.ns_names is not None:
+            # Follow the referral as soon as one nameserver has an address;
+            # the other names are only looked up if its servers fail
+            while not lookup.next_servers and lookup.ns_names:
+                ns_name = lookup.ns_names.pop(0)
+                sockaddrs = self._cache_get(self._ns_cache, ns_name)
+                if sockaddrs is not None:
+                    lookup.next_servers.update(dict.fromkeys(sockaddrs))
+                    continue
+
+                # Without glue, look the nameserver up starting from the
+                # closest zone we already know rather than the roots
+                lookup.ns_name = ns_name
+                return _Lookup(ns_name, _A, lookup.depth + 1)
+
+            self._follow_referral(lookup)
+            return None
+
+        qname, qtype = lookup.qname, lookup.qtype
+        cached = self._cache_get(self._cache, (qname, qtype))
+        if cached is not None:
+            return self._cache_aliases(lookup.aliases, qtype, cached)
+
+        if self._cache_get(self._nx_cache, qname):
+            raise NXDomainError(f"Domain {qname} does not exist (NXDOMAIN)")
+
+        if lookup.nameservers is None:
+            lookup.bailiwick, lookup.nameservers = self._closest_nameservers(qname)
+        try:
+            response, server = yield lookup
+        except Exception:
+            if not lookup.ns_names:
+                raise
+            # The referral's nameservers failed; look up its next NS name
+            lookup.nameservers = None
+            return None
+        lookup.ns_names = None
+
+        # Check for NXDOMAIN (domain does not exist)
+        if response.rcode() == _NXDOMAIN:
+            self._cache_put(self._nx_cache, qname, True, self._negative_ttl(response))
+            raise NXDomainError(f"Domain {qname} does not exist (NXDOMAIN)")
+
+        # Check if we got an answer; servers often put the whole CNAME chain
+        # and its final records in one response, so follow it from qname and
+        # only accept records owned by the name it ends at
+        aliases, cname_target, answer = _answer_chain(response, qname, qtype)
+        lookup.aliases.extend(aliases)
+        if answer is not None:
+            ttl = min(r.ttl for r in response.answer)
+            self._cache_put(self._cache, (cname_target, qtype), response, ttl)
+            return self._cache_aliases(lookup.aliases, qtype, response)
+
+        if aliases:
+            if any(alias == cname_target for alias, _ in lookup.aliases):
+                raise DNSResolutionError(f"CNAME loop detected at {cname_target}")
+            if len(lookup.aliases) > self.MAX_CNAME_HOPS:
+                raise DNSResolutionError(f"CNAME chain too long for {qname}")
+
+            # Restart the walk for the alias target from the closest known zone
+            lookup.qname = cname_target
+            lookup.nameservers = None
+            lookup.referrals = 0
+            return None
+
+        # Glue records from the additional section, by nameserver name
+        glue = {
+            rrset.name: rrset for rrset in response.additional if rrset.rdtype == _A
+        }
+
+        # Try to follow authority records (NS records)
+        lookup.zone = None
+        ns_names = {}
+
+        for rrset in response.authority:
+            if rrset.rdtype == _NS:
+                lookup.zone, lookup.zone_ttl = rrset.name, rrset.ttl
+                ns_names.update(dict.fromkeys(rr.target for rr in rrset))
+            # Check for SOA record which might indicate NXDOMAIN or no such record
+            elif rrset.rdtype == _SOA:
+                # SOA without NS could mean the name exists but no A record
+                if lookup.zone is None and qtype == _A:
+                    raise NoRecordError(f"No A record found for {qname}")
+
+        # Only a referral to a zone strictly below the one being queried and
+        # enclosing qname is followed; anything else is lame, so ask the other
+        # nameservers and keep nothing from this one
+        zone = lookup.zone
+        if zone is not None and (
+            zone == lookup.bailiwick
+            or not zone.is_subdomain(lookup.bailiwick)
+            or not qname.is_subdomain(zone)
+        ):
+            lookup.zone = None
+            lookup.nameservers = [ns for ns in lookup.nameservers if ns != server]
+            if not lookup.nameservers:
+                raise DNSResolutionError(
+                    f"Lame referral to {zone} while resolving {qname}"
+                )
+            return None
+
+        if zone is not None:
+            lookup.referrals += 1
+            if lookup.referrals > self.MAX_REFERRALS:
+                raise DNSResolutionError(f"Too many referrals while resolving {qname}")
+
+        # Use glue for the nameservers that have it; the rest only need
+        # looking up when none of the nameservers came with glue
+        glueless = []
+        for ns_name in ns_names:
+            rrset = glue.get(ns_name)
+            if rrset is None:
+                glueless.append(ns_name)
+                continue
+            sockaddrs = [(rr.address, 53) for rr in rrset]
+            # Glue is only authoritative inside the delegated zone; glue for
+            # other names serves this hop but is not kept for later lookups
+            if ns_name.is_subdomain(lookup.zone):
+                self._cache_put(self._ns_cache, ns_name, sockaddrs, rrset.ttl)
+            lookup.next_servers.update(dict.fromkeys(sockaddrs))
+
+        if not lookup.next_servers and glueless and lookup.depth < self.MAX_NS_DEPTH:
+            lookup.ns_names = glueless
+            lookup.nameservers = None
+            return None
+
+        self._follow_referral(lookup)
+        return None
+
+    def _follow_referral(self, lookup):
+        """Point a lookup at the nameservers gathered from its last referral"""
+        next_servers = list(lookup.next_servers)
+        lookup.next_servers = {}
+
+        if not next_servers:
+            if lookup.zone is not None:
+                # We found NS records but couldn't resolve any of them
+                raise NoRecordError(
+                    f"Found NS records but could not resolve any nameserver IPs for {lookup.qname}"
+                )
+            # We got a response but no answer or referral with useful info
+            raise NoRecordError(f"No A or NS records found for {lookup.qname}")
+
+        # The delegated zone's servers become the nameservers for the next round trip
+        if lookup.zone is not None:
+            self._cache_put(
+                self._zone_cache, lookup.zone, next_servers, lookup.zone_ttl
+            )
+        lookup.bailiwick = lookup.zone
+        lookup.nameservers = next_servers
+
     def format_output(self, domain, response):
         if not response or not response.answer:
             return f"No answer found for {domain}"
@@ -195,27 +731,25 @@ class DNSQuestResolver:
         output.append("")
         output.append("ANSWER SECTION:")
 
-        # Find the final A record IP address
+        # Find the final A record IP address at the end of the CNAME chain
         final_ip = None
         final_ttl = None
-        for rrset in response.answer:
-            if rrset.rdtype == dns.rdatatype.A:
-                for rr in rrset:
-                    final_ip = rr.address
-                    final_ttl = rrset.ttl
-                    break
-                break
+        qname = response.question[0].name if response.question else _parse_name(domain)
+        _, _, rrset = _answer_chain(response, qname, _A)
+        if rrset is not None:
+            final_ip = rrset[0].address
+            final_ttl = rrset.ttl
 
         if final_ip:
-            # Calculate spacing to align IN column with question section
-            ttl_str = str(final_ttl)
-            spaces_needed = 32 - len(domain) - len(ttl_str) - 3
+            # Right-align the TTL so the IN column lines up with the question
+            # section, keeping at least one space after long domains
+            ttl_width = max(28 - len(domain), 0)
             output.append(
-                f"{domain}{' ' * spaces_needed}{final_ttl}    IN      A       {final_ip}"
+                f"{domain} {final_ttl:>{ttl_width}}    IN      A       {final_ip}"
             )
 
         output.append("")
-        query_time = int((time.time() - self.query_start_time) * 1000)
+        query_time = (time.monotonic_ns() - self.query_start_time) // 1_000_000
         output.append(f"Query time: {query_time} msec")
         current_time = datetime.datetime.now().strftime("%a %b %d %H:%M:%S %Y")
         output.append(f"WHEN: {current_time}")
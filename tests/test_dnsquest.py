@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 
+import asyncio
+import socket
+import threading
+import time
 import pytest
+import dns.message
+import dns.name
+import dns.rdatatype
+import dns.rcode
+import dns.rrset
 from dnsquest import (
     DNSQuestResolver,
     DNSResolutionError,
@@ -30,6 +39,14 @@ class TestDNSQuestResolver:
             for part in parts:
                 assert 0 <= int(part) <= 255
 
+    def test_root_servers_rotate(self):
+        """Test that each walk from the roots starts at the next root server"""
+        resolver = DNSQuestResolver()
+        first = resolver._root_servers()
+        second = resolver._root_servers()
+        assert sorted(ip for ip, _ in first) == sorted(resolver.ROOT_SERVERS)
+        assert second == first[1:] + first[:1]
+
     def test_resolve_google(self):
         """Test resolving a well-known domain"""
         resolver = DNSQuestResolver()
@@ -58,6 +75,24 @@ class TestDNSQuestResolver:
         with pytest.raises(NXDomainError):
             resolver.resolve("thisdoesnotexist12345xyz.com")
 
+    def test_invalid_names_rejected_locally(self, canned_probe):
+        """Test that malformed names raise NXDOMAIN without any queries"""
+        resolver = DNSQuestResolver()
+        probes = canned_probe(lambda qname, qtype, nameservers: None)
+        for domain in [
+            "bad name.com",
+            "exa$mple.com",
+            "www..example.com",
+            "a" * 64 + ".com",
+            "\u00fc" * 63 + ".de",
+            ".".join(["abcdefgh"] * 30),
+            "printer.local",
+            "www.example.invalid.",
+        ]:
+            with pytest.raises(NXDomainError):
+                resolver.resolve(domain)
+        assert probes == []
+
     def test_format_output(self):
         """Test output formatting"""
         resolver = DNSQuestResolver()
@@ -74,6 +109,60 @@ class TestDNSQuestResolver:
         except Exception as e:
             pytest.skip(f"Network issue or DNS server unreachable: {e}")
 
+    def test_format_output_alignment(self, canned_probe):
+        """Test that the answer row lines up with the question row"""
+        resolver = DNSQuestResolver()
+        canned_probe(answer_a("93.184.216.34"))
+        response = resolver.resolve("www.example.com")
+        lines = resolver.format_output("www.example.com", response).splitlines()
+        assert lines[1].index("IN") == lines[4].index("IN")
+        assert lines[4].startswith("www.example.com.          300    IN")
+
+        long_domain = "a-very-long-subdomain-name.example.com"
+        response = resolver.resolve(long_domain)
+        row = resolver.format_output(long_domain, response).splitlines()[4]
+        assert row.startswith(f"{long_domain}. 300    IN")
+
+    def test_flattened_cname_not_followed(self, canned_probe):
+        """Test that a CNAME answered together with its A record needs one query"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            return make_response(
+                qname,
+                dns.rrset.from_text(qname, 300, "IN", "CNAME", "www.example.net."),
+                dns.rrset.from_text("www.example.net.", 60, "IN", "A", "192.0.2.7"),
+            )
+
+        probes = canned_probe(handler)
+        response = resolver.resolve("alias.example.com")
+        assert len(probes) == 1
+        assert response.answer[-1][0].address == "192.0.2.7"
+
+    def test_unrelated_answer_records_ignored(self, canned_probe):
+        """Test that an A record off the CNAME chain is not taken as the answer"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            if qname.to_text() == "target.example.net.":
+                return make_response(
+                    qname, dns.rrset.from_text(qname, 300, "IN", "A", "192.0.2.9")
+                )
+            return make_response(
+                qname,
+                dns.rrset.from_text(qname, 300, "IN", "CNAME", "target.example.net."),
+                dns.rrset.from_text("evil.attacker.org.", 300, "IN", "A", "6.6.6.6"),
+            )
+
+        probes = canned_probe(handler)
+        response = resolver.resolve("www.bank.com")
+        output = resolver.format_output("www.bank.com", response)
+        assert len(probes) == 2
+        assert "192.0.2.9" in output
+        assert "6.6.6.6" not in output
+        cached = resolver.resolve("www.bank.com")
+        assert "6.6.6.6" not in resolver.format_output("www.bank.com", cached)
+
     def test_domain_with_trailing_dot(self):
         """Test that domains with trailing dots are handled correctly"""
         resolver = DNSQuestResolver()
@@ -98,6 +187,692 @@ class TestDNSQuestResolver:
             pytest.skip(f"Network issue or DNS server unreachable: {e}")
 
 
+def make_response(qname, *rrsets, rdtype="A"):
+    """Build a canned DNS response for qname carrying the given answer rrsets"""
+    query = dns.message.make_query(qname, rdtype)
+    response = dns.message.make_response(query)
+    response.answer.extend(rrsets)
+    return response
+
+
+def answer_a(address, ttl=300):
+    """Return a canned_probe handler answering every query with one A record"""
+
+    def handler(qname, qtype, nameservers):
+        return make_response(qname, dns.rrset.from_text(qname, ttl, "IN", "A", address))
+
+    return handler
+
+
+@pytest.fixture
+def canned_probe(monkeypatch):
+    """Answer the resolver's queries from a handler instead of the network
+
+    Call the fixture with handler(qname, qtype, nameservers) returning the
+    response for each query, which is credited to the first nameserver; it
+    returns the list of (qname, nameservers) queries made, for both resolve()
+    and aresolve().
+    """
+
+    def install(handler):
+        probes = []
+
+        def fake_probe(self, qname, qtype, nameservers):
+            probes.append((qname, list(nameservers)))
+            response = handler(qname, qtype, nameservers)
+            if response is None:
+                pytest.fail(f"unexpected query for {qname}")
+            return response, nameservers[0]
+
+        async def fake_aprobe(self, qname, qtype, nameservers):
+            await asyncio.sleep(0)
+            return fake_probe(self, qname, qtype, nameservers)
+
+        monkeypatch.setattr(DNSQuestResolver, "_probe", fake_probe)
+        monkeypatch.setattr(DNSQuestResolver, "_aprobe", fake_aprobe)
+        return probes
+
+    return install
+
+
+@pytest.fixture
+def udp_server():
+    """Run UDP nameservers on 127.0.0.1 for the real _probe to query
+
+    Call the fixture with handler(query) returning the response message, or
+    None to stay silent; it returns the server's sockaddr and the list of
+    (packet, sender sockaddr) queries it received.
+    """
+    stop = threading.Event()
+    servers = []
+
+    def start(handler):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(0.05)
+        received = []
+
+        def serve():
+            while not stop.is_set():
+                try:
+                    data, peer = sock.recvfrom(4096)
+                except OSError:
+                    continue
+                received.append((data, peer))
+                response = handler(dns.message.from_wire(data))
+                if response is not None:
+                    sock.sendto(response.to_wire(), peer)
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        servers.append((sock, thread))
+        return sock.getsockname(), received
+
+    yield start
+    stop.set()
+    for sock, thread in servers:
+        thread.join()
+        sock.close()
+
+
+def answer_query(query):
+    """udp_server handler answering every query with one A record"""
+    response = dns.message.make_response(query)
+    response.answer.append(
+        dns.rrset.from_text(query.question[0].name, 300, "IN", "A", "192.0.2.1")
+    )
+    return response
+
+
+class TestProbe:
+    """Test the UDP query path against local nameservers"""
+
+    def test_query_packet(self, udp_server):
+        """Test that the query sent matches dnspython's apart from the ID"""
+        sockaddr, received = udp_server(answer_query)
+        qname = dns.name.from_text("www.example.com.")
+        with DNSQuestResolver() as resolver:
+            response, server = resolver._probe(qname, dns.rdatatype.A, [sockaddr])
+        expected = dns.message.make_query(qname, "A").to_wire()
+        assert len(received) == 1
+        packet, _ = received[0]
+        assert packet[2:] == expected[2:]
+        assert response.id == int.from_bytes(packet[:2], "big")
+        assert response.answer[0][0].address == "192.0.2.1"
+        assert server == sockaddr
+
+    def test_failed_servers_skipped(self, udp_server):
+        """Test that SERVFAIL and silent servers give way to one that answers"""
+
+        def servfail(query):
+            response = dns.message.make_response(query)
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response
+
+        silent, _ = udp_server(lambda query: None)
+        failing, _ = udp_server(servfail)
+        working, _ = udp_server(answer_query)
+        qname = dns.name.from_text("www.example.com.")
+        with DNSQuestResolver() as resolver:
+            response, server = resolver._probe(
+                qname, dns.rdatatype.A, [silent, failing, working]
+            )
+        assert server == working
+        assert response.rcode() == dns.rcode.NOERROR
+
+    def test_silent_servers_time_out(self, udp_server, monkeypatch):
+        """Test that TimeoutError is raised once QUERY_TIMEOUT passes unanswered"""
+        monkeypatch.setattr(DNSQuestResolver, "QUERY_TIMEOUT", 0.2)
+        silent, received = udp_server(lambda query: None)
+        qname = dns.name.from_text("www.example.com.")
+        start = time.monotonic()
+        with DNSQuestResolver() as resolver:
+            with pytest.raises(TimeoutError):
+                resolver._probe(qname, dns.rdatatype.A, [silent])
+        assert time.monotonic() - start >= 0.2
+        assert len(received) == 1
+
+    def test_source_port_varies(self, udp_server, monkeypatch):
+        """Test that each resolve() queries from a new socket"""
+        sockaddr, received = udp_server(answer_query)
+        monkeypatch.setattr(DNSQuestResolver, "ROOT_SERVERS", (sockaddr[0],))
+        monkeypatch.setattr(DNSQuestResolver, "_ROOT_SOCKADDRS", (sockaddr,))
+        with DNSQuestResolver() as resolver:
+            for n in range(4):
+                resolver.resolve(f"host{n}.example.com")
+        assert len({peer for _, peer in received}) == 4
+
+    def test_threads_share_resolver(self, udp_server):
+        """Test that probes from several threads each receive their own reply"""
+
+        def slow_answer(query):
+            time.sleep(0.01)
+            return answer_query(query)
+
+        sockaddr, _ = udp_server(slow_answer)
+        resolver = DNSQuestResolver()
+        errors = []
+
+        def probe(n):
+            qname = dns.name.from_text(f"host{n}.example.com.")
+            try:
+                response, _ = resolver._probe(qname, dns.rdatatype.A, [sockaddr])
+                assert response.question[0].name == qname
+            except Exception as e:
+                errors.append(e)
+            finally:
+                resolver.close()
+
+        threads = [threading.Thread(target=probe, args=(n,)) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+
+class TestAsyncProbe:
+    """Test the asyncio query path against local nameservers"""
+
+    def test_silent_server_skipped(self, udp_server, monkeypatch):
+        """Test that a server that answers wins over one that stays silent"""
+        monkeypatch.setattr(DNSQuestResolver, "QUERY_TIMEOUT", 0.5)
+        silent, _ = udp_server(lambda query: None)
+        working, received = udp_server(answer_query)
+        qname = dns.name.from_text("www.example.com.")
+        resolver = DNSQuestResolver()
+        response, server = asyncio.run(
+            resolver._aprobe(qname, dns.rdatatype.A, [silent, working])
+        )
+        assert server == working
+        assert response.answer[0][0].address == "192.0.2.1"
+        assert len(received) == 1
+
+    def test_silent_servers_time_out(self, udp_server, monkeypatch):
+        """Test that TimeoutError is raised when no server answers"""
+        monkeypatch.setattr(DNSQuestResolver, "QUERY_TIMEOUT", 0.2)
+        first, _ = udp_server(lambda query: None)
+        second, _ = udp_server(lambda query: None)
+        qname = dns.name.from_text("www.example.com.")
+        resolver = DNSQuestResolver()
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            asyncio.run(resolver._aprobe(qname, dns.rdatatype.A, [first, second]))
+        assert time.monotonic() - start >= 0.2
+
+
+class TestResponseCache:
+    """Test the TTL-aware response cache"""
+
+    def test_repeat_resolve_served_from_cache(self, canned_probe):
+        """Test that a second resolve of the same name sends no queries"""
+        resolver = DNSQuestResolver()
+        probes = canned_probe(answer_a("93.184.216.34"))
+        first = resolver.resolve("www.example.com")
+        second = resolver.resolve("www.example.com")
+        assert second is first
+        assert len(probes) == 1
+
+    def test_trailing_dot_shares_cache_entry(self, canned_probe):
+        """Test that names with and without a trailing dot resolve the same name"""
+        resolver = DNSQuestResolver()
+        probes = canned_probe(answer_a("93.184.216.34"))
+        resolver.resolve("www.example.com")
+        resolver.resolve("www.example.com.")
+        assert [q.to_text() for q, _ in probes] == ["www.example.com."]
+
+    def test_expired_entry_is_dropped(self):
+        """Test that cache entries are ignored once their TTL has passed"""
+        resolver = DNSQuestResolver()
+        resolver._cache_put(resolver._cache, "key", "value", 0)
+        assert resolver._cache_get(resolver._cache, "key") is None
+        assert "key" not in resolver._cache
+
+    def test_nxdomain_served_from_cache(self, canned_probe):
+        """Test that a repeated NXDOMAIN is answered without new queries"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            response = make_response(qname)
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(
+                dns.rrset.from_text(
+                    "com.", 900, "IN", "SOA", "a.gtld.com. n.com. 1 2 3 4 900"
+                )
+            )
+            return response
+
+        probes = canned_probe(handler)
+        for _ in range(2):
+            with pytest.raises(NXDomainError):
+                resolver.resolve("thisdoesnotexist12345xyz.com")
+        assert len(probes) == 1
+
+    def test_nxdomain_cache_ttl(self, canned_probe):
+        """Test that NXDOMAIN is cached for min(SOA TTL, MINIMUM), capped at 300s"""
+        resolver = DNSQuestResolver()
+        # SOA TTL and MINIMUM in each answer, or None for no SOA at all
+        cases = {
+            "a.example.com.": ((900, 120), 120),
+            "b.example.com.": ((100, 900), 100),
+            "c.example.com.": ((3600, 3600), 300),
+            "d.example.com.": (None, 60),
+        }
+
+        def handler(qname, qtype, nameservers):
+            soa, _ = cases[qname.to_text()]
+            response = make_response(qname)
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            if soa is not None:
+                ttl, minimum = soa
+                response.authority.append(
+                    dns.rrset.from_text(
+                        "example.com.",
+                        ttl,
+                        "IN",
+                        "SOA",
+                        f"ns.example.com. admin.example.com. 1 2 3 4 {minimum}",
+                    )
+                )
+            return response
+
+        canned_probe(handler)
+        for name, (_, expected) in cases.items():
+            start = time.monotonic()
+            with pytest.raises(NXDomainError):
+                resolver.resolve(name)
+            expiry, _ = resolver._nx_cache[dns.name.from_text(name)]
+            assert start + expected <= expiry <= time.monotonic() + expected
+
+
+class TestReferrals:
+    """Test how referrals pick the next nameservers"""
+
+    def test_glue_used_without_lookups(self, canned_probe):
+        """Test that glue is used directly and unrelated additional records ignored"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            if len(probes) > 1:
+                return make_response(
+                    qname,
+                    dns.rrset.from_text(qname, 300, "IN", "A", "93.184.216.34"),
+                )
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text(
+                    "example.com.",
+                    300,
+                    "IN",
+                    "NS",
+                    "ns1.example.com.",
+                    "ns2.other.net.",
+                )
+            )
+            response.additional.append(
+                dns.rrset.from_text("ns1.example.com.", 300, "IN", "A", "192.0.2.1")
+            )
+            response.additional.append(
+                dns.rrset.from_text(
+                    "unrelated.example.org.", 300, "IN", "A", "192.0.2.99"
+                )
+            )
+            return response
+
+        probes = canned_probe(handler)
+        resolver.resolve("www.example.com")
+        assert len(probes) == 2
+        assert probes[1][1] == [("192.0.2.1", 53)]
+
+    def test_duplicate_nameservers_queried_once(self, canned_probe):
+        """Test that addresses repeated across NS names are queried once, in order"""
+        resolver = DNSQuestResolver()
+        glue = {
+            "ns1.example.com.": ("192.0.2.1", "192.0.2.2"),
+            "ns2.example.com.": ("192.0.2.2", "192.0.2.3"),
+            "ns3.example.com.": ("192.0.2.1",),
+        }
+
+        def handler(qname, qtype, nameservers):
+            if len(probes) > 1:
+                return make_response(
+                    qname,
+                    dns.rrset.from_text(qname, 300, "IN", "A", "93.184.216.34"),
+                )
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text("example.com.", 300, "IN", "NS", *glue)
+            )
+            response.authority.append(
+                dns.rrset.from_text("example.com.", 300, "IN", "NS", "ns1.example.com.")
+            )
+            for ns_name, addresses in glue.items():
+                response.additional.append(
+                    dns.rrset.from_text(ns_name, 300, "IN", "A", *addresses)
+                )
+            return response
+
+        probes = canned_probe(handler)
+        resolver.resolve("www.example.com")
+        assert probes[1][1] == [
+            ("192.0.2.1", 53),
+            ("192.0.2.2", 53),
+            ("192.0.2.3", 53),
+        ]
+
+    def test_glueless_nameserver_looked_up(self, canned_probe):
+        """Test that the referral is followed once the first glue-less NS resolves"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            name = qname.to_text()
+            if name == "www.example.com." and nameservers == [("192.0.2.53", 53)]:
+                return make_response(
+                    qname,
+                    dns.rrset.from_text(qname, 300, "IN", "A", "93.184.216.34"),
+                )
+            if name == "ns1.dns.net.":
+                return make_response(
+                    qname, dns.rrset.from_text(qname, 300, "IN", "A", "192.0.2.53")
+                )
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text(
+                    "example.com.", 300, "IN", "NS", "ns1.dns.net.", "ns2.dns.net."
+                )
+            )
+            return response
+
+        probes = canned_probe(handler)
+        response = resolver.resolve("www.example.com")
+        assert response.answer[0][0].address == "93.184.216.34"
+        assert [q.to_text() for q, _ in probes] == [
+            "www.example.com.",
+            "ns1.dns.net.",
+            "www.example.com.",
+        ]
+
+    def test_glueless_nameserver_ignores_unrelated_addresses(self, canned_probe):
+        """Test that only the A record owned by the NS name becomes its address"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            name = qname.to_text()
+            if name == "www.example.com." and nameservers == [("192.0.2.53", 53)]:
+                return make_response(
+                    qname,
+                    dns.rrset.from_text(qname, 300, "IN", "A", "93.184.216.34"),
+                )
+            if name == "ns1.dns.net.":
+                return make_response(
+                    qname,
+                    dns.rrset.from_text("evil.dns.net.", 300, "IN", "A", "6.6.6.6"),
+                    dns.rrset.from_text(qname, 300, "IN", "A", "192.0.2.53"),
+                )
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text("example.com.", 300, "IN", "NS", "ns1.dns.net.")
+            )
+            return response
+
+        probes = canned_probe(handler)
+        resolver.resolve("www.example.com")
+        assert all(("6.6.6.6", 53) not in servers for _, servers in probes)
+        ns_name = dns.name.from_text("ns1.dns.net.")
+        assert resolver._ns_cache[ns_name][1] == [("192.0.2.53", 53)]
+
+    def test_glueless_fallback_when_nameserver_fails(self, canned_probe):
+        """Test that the next glue-less NS is looked up when the first one fails"""
+        resolver = DNSQuestResolver()
+        addresses = {"ns1.dns.net.": "192.0.2.53", "ns2.dns.net.": "192.0.2.54"}
+
+        def handler(qname, qtype, nameservers):
+            name = qname.to_text()
+            if nameservers == [("192.0.2.53", 53)]:
+                raise TimeoutError(f"DNS query timed out for {qname}")
+            if nameservers == [("192.0.2.54", 53)]:
+                return make_response(
+                    qname,
+                    dns.rrset.from_text(qname, 300, "IN", "A", "93.184.216.34"),
+                )
+            if name in addresses:
+                return make_response(
+                    qname, dns.rrset.from_text(qname, 300, "IN", "A", addresses[name])
+                )
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text(
+                    "example.com.", 300, "IN", "NS", "ns1.dns.net.", "ns2.dns.net."
+                )
+            )
+            return response
+
+        probes = canned_probe(handler)
+        response = resolver.resolve("www.example.com")
+        assert response.answer[0][0].address == "93.184.216.34"
+        assert [q.to_text() for q, _ in probes] == [
+            "www.example.com.",
+            "ns1.dns.net.",
+            "www.example.com.",
+            "ns2.dns.net.",
+            "www.example.com.",
+        ]
+
+    def test_glueless_lookups_limited(self, canned_probe):
+        """Test that nested glue-less NS lookups stop at MAX_NS_DEPTH"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            # Every zone is served by a glue-less name in a zone never seen before
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text(
+                    qname.parent(), 300, "IN", "NS", f"ns.d{len(probes)}.net."
+                )
+            )
+            return response
+
+        probes = canned_probe(handler)
+        with pytest.raises(NoRecordError):
+            resolver.resolve("www.example.com")
+        assert len(probes) == resolver.MAX_NS_DEPTH + 1
+
+    def test_out_of_zone_glue_not_cached(self, canned_probe):
+        """Test that glue for names outside the delegated zone is used but not kept"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            if len(probes) > 1:
+                return make_response(
+                    qname,
+                    dns.rrset.from_text(qname, 300, "IN", "A", "93.184.216.34"),
+                )
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text(
+                    "example.com.",
+                    300,
+                    "IN",
+                    "NS",
+                    "ns1.example.com.",
+                    "ns.other.net.",
+                )
+            )
+            response.additional.append(
+                dns.rrset.from_text("ns1.example.com.", 300, "IN", "A", "192.0.2.1")
+            )
+            response.additional.append(
+                dns.rrset.from_text("ns.other.net.", 300, "IN", "A", "192.0.2.66")
+            )
+            return response
+
+        probes = canned_probe(handler)
+        resolver.resolve("www.example.com")
+        assert probes[1][1] == [("192.0.2.1", 53), ("192.0.2.66", 53)]
+        assert dns.name.from_text("ns1.example.com.") in resolver._ns_cache
+        assert dns.name.from_text("ns.other.net.") not in resolver._ns_cache
+
+    def test_lame_referral_tries_next_server(self, canned_probe):
+        """Test that an out-of-bailiwick referral is skipped and not cached"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            response = make_response(qname)
+            if len(probes) == 1:
+                response.authority.append(
+                    dns.rrset.from_text(
+                        "com.", 300, "IN", "NS", "a.gtld.com.", "b.gtld.com."
+                    )
+                )
+                response.additional.append(
+                    dns.rrset.from_text("a.gtld.com.", 300, "IN", "A", "192.0.2.1")
+                )
+                response.additional.append(
+                    dns.rrset.from_text("b.gtld.com.", 300, "IN", "A", "192.0.2.2")
+                )
+            elif len(probes) == 2:
+                response.authority.append(
+                    dns.rrset.from_text("org.", 300, "IN", "NS", "ns.evil.org.")
+                )
+                response.additional.append(
+                    dns.rrset.from_text("ns.evil.org.", 300, "IN", "A", "192.0.2.66")
+                )
+            else:
+                response.answer.append(
+                    dns.rrset.from_text(qname, 300, "IN", "A", "93.184.216.34")
+                )
+            return response
+
+        probes = canned_probe(handler)
+        resolver.resolve("www.example.com")
+        assert probes[1][1] == [("192.0.2.1", 53), ("192.0.2.2", 53)]
+        assert probes[2][1] == [("192.0.2.2", 53)]
+        assert dns.name.from_text("org.") not in resolver._zone_cache
+        assert dns.name.from_text("ns.evil.org.") not in resolver._ns_cache
+
+
+class TestLoopProtection:
+    """Test that looping zones fail instead of hanging the resolver"""
+
+    def test_cname_loop(self, canned_probe):
+        """Test that a CNAME cycle raises DNSResolutionError"""
+        resolver = DNSQuestResolver()
+        targets = {
+            "a.example.com.": "b.example.com.",
+            "b.example.com.": "a.example.com.",
+        }
+
+        def handler(qname, qtype, nameservers):
+            return make_response(
+                qname,
+                dns.rrset.from_text(
+                    qname, 300, "IN", "CNAME", targets[qname.to_text()]
+                ),
+            )
+
+        probes = canned_probe(handler)
+        with pytest.raises(DNSResolutionError):
+            resolver.resolve("a.example.com")
+        assert len(probes) == 2
+
+    def test_cname_chain_too_long(self, canned_probe):
+        """Test that a chain of distinct CNAMEs is cut off at MAX_CNAME_HOPS"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            target = f"c{len(probes)}.example.com."
+            return make_response(
+                qname, dns.rrset.from_text(qname, 300, "IN", "CNAME", target)
+            )
+
+        probes = canned_probe(handler)
+        with pytest.raises(DNSResolutionError, match="CNAME chain too long"):
+            resolver.resolve("c0.example.com")
+        assert len(probes) == resolver.MAX_CNAME_HOPS + 1
+        assert len({q for q, _ in probes}) == len(probes)
+
+    def test_too_many_referrals(self, canned_probe):
+        """Test that a delegation chain deeper than MAX_REFERRALS is cut off"""
+        resolver = DNSQuestResolver()
+        domain = ".".join(["l"] * 20) + ".example.com"
+
+        def handler(qname, qtype, nameservers):
+            # Each referral delegates one label further down the name
+            n = len(probes)
+            zone = dns.name.Name(qname.labels[-(n + 1) :])
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text(zone, 300, "IN", "NS", f"ns.{zone}")
+            )
+            response.additional.append(
+                dns.rrset.from_text(f"ns.{zone}", 300, "IN", "A", f"192.0.2.{n}")
+            )
+            return response
+
+        probes = canned_probe(handler)
+        with pytest.raises(DNSResolutionError, match="Too many referrals"):
+            resolver.resolve(domain)
+        assert len(probes) == resolver.MAX_REFERRALS + 1
+
+    def test_referral_loop(self, canned_probe):
+        """Test that a referral that gets no closer to the name is rejected"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            response = make_response(qname)
+            response.authority.append(
+                dns.rrset.from_text("com.", 300, "IN", "NS", "a.gtld.com.")
+            )
+            response.additional.append(
+                dns.rrset.from_text("a.gtld.com.", 300, "IN", "A", "192.0.2.1")
+            )
+            return response
+
+        probes = canned_probe(handler)
+        with pytest.raises(DNSResolutionError):
+            resolver.resolve("www.example.com")
+        assert len(probes) == 2
+
+
+class TestAsyncResolve:
+    """Test the asyncio entry point"""
+
+    def test_aresolve_concurrently(self, canned_probe):
+        """Test that several aresolve() calls can share one event loop"""
+        resolver = DNSQuestResolver()
+        addresses = {"www.example.com.": "192.0.2.1", "www.example.org.": "192.0.2.2"}
+
+        def handler(qname, qtype, nameservers):
+            return make_response(
+                qname,
+                dns.rrset.from_text(qname, 300, "IN", "A", addresses[qname.to_text()]),
+            )
+
+        async def resolve_all():
+            return await asyncio.gather(
+                resolver.aresolve("www.example.com"),
+                resolver.aresolve("www.example.org"),
+            )
+
+        canned_probe(handler)
+        first, second = asyncio.run(resolve_all())
+        assert first.answer[0][0].address == "192.0.2.1"
+        assert second.answer[0][0].address == "192.0.2.2"
+
+    def test_aresolve_nxdomain(self, canned_probe):
+        """Test that aresolve() raises the same errors as resolve()"""
+        resolver = DNSQuestResolver()
+
+        def handler(qname, qtype, nameservers):
+            response = make_response(qname)
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            return response
+
+        canned_probe(handler)
+        with pytest.raises(NXDomainError):
+            asyncio.run(resolver.aresolve("thisdoesnotexist12345xyz.com"))
+
+
 class TestExceptions:
     """Test custom exception classes"""
 